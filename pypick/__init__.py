@@ -83,6 +83,18 @@ attributes are supported:
         The following are examples of valid shortcut value: 'u', 'U',
         ' ' (space), 'ctrl u', 'f1', 'right', etc.
 
+        If the list contains more than 10 items, the shortcut opens a
+        popup instead, where user can type to search the values and
+        press 'enter' to choose one.
+
+  - format (type: callable, default: None):
+        A function converting the field's value to the text shown in
+        UI, e.g., formatting a timestamp or a size in bytes. It's called
+        when the value is shown on screen, and when entries are searched
+        the first time (queries match the formatted text). If not
+        specified, str() is used. It isn't called for a missing field
+        or an empty list, which is shown as ''. Note it doesn't change
+        the value returned when the entry is selected.
   - return (type: boolean, default: True):
         Whether to return the field's data when the entry is selected.
 
@@ -103,12 +115,13 @@ different foreground and background color combinations. The
 foreground/background color combination is called text style in Pick.
 A text style has a name so it can be referenced.
 
-Pick defines five text styles:
+Pick defines six text styles:
 
   - 'focused': Text style to display item being focused
   - 'cirtical': Text style to display items which have '_critical' set
   - 'normal': Default text style to display fields
   - 'trivial': Text style to display unimportant ('trivial') fields
+  - 'match': Text style to highlight text matching the query
   - 'default': Text style to display title (e.g., group name, etc.)
 
 User can reference these text style names in fields attributes.
@@ -159,10 +172,62 @@ fields are returned.
     $ python3 test_pick.py
     {'user': 'rayx', 'project': 'project X', 'name': 'server-5',
      'host': '10.64.4.5'}
+
+5. Query Without UI
+-------------------
+
+Pick.query() finds entries matching a query without showing UI, e.g.,
+in a script resolving a host name. It returns a list of dicts in the
+same format as Pick.run() does. Continuing the above example:
+
+    >>> p.query('server-66')
+    [{'project': 'project Y', 'name': 'server-66', 'host': '10.64.4.66',
+      'user': 'root'}]
+
+A query consists of terms separated by whitespace. An entry matches the
+query if its fields shown in UI contain all the terms. Matching is
+case-insensitive. Use Pick.query_many() to run a batch of queries.
+
+6. Multi-select Mode
+--------------------
+
+Pick.run(multi_select=True) allows user to select multiple entries with
+the following keys:
+
+  - ' ' (space): Select or deselect the focused entry.
+  - '+': Select all entries shown (i.e., matching the query, if any).
+  - '-': Deselect all entries shown.
+  - '*': Invert selection of the entries shown.
+  - '=': Select entries between the one last selected or deselected
+         by space and the focused one.
+
+When user presses 'enter', run() returns a read-only sequence containing
+the selected entries' data (or the focused one if none is selected).
+Each entry's data is a dict in the same format as in single-select mode.
+The sequence supports len(), indexing, iteration and comparison with a
+list. Use list() to get a list, e.g., for json.dumps(). Note an entry
+remains selected if it's hidden by a query.
+
+7. Preview
+----------
+
+Pick(preview=callback) shows a preview pane for the entry being focused.
+The callback is called with the entry's data dict and returns the text
+to show, e.g., the output of a command run on the host:
+
+    p = Pick(fields, preview=lambda entry: get_uptime(entry['host']))
+
+The pane is at the bottom of the list by default. Pass
+preview_position='right' to show it on the right side instead.
+
+The callback runs in a thread pool, so it doesn't block the UI. It's
+called only after focus stays on an entry for a short while, and its
+results are cached for the most recently previewed entries. If the
+callback raises an exception, the error is shown in the pane.
 """
 
 from .pick import Pick, Group
-from .ui import set_theme, NoSpace
+from .common import set_theme, NoSpace
 
 __all__ = ['Pick', 'Group', 'NoSpace', 'set_theme']
 __version__ = '0.2.1'
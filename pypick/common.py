@@ -0,0 +1,133 @@
+# Copyright (C) 2019 by Huan Xiong. All Rights Reserved.
+# Licensed under GPLv3 or later. See LICENSE file under top level directory.
+
+"""
+Definitions shared by the UI and Pick.query(). This module doesn't
+depend on urwid, so that querying entries doesn't load it.
+"""
+
+# Field attributes and their default values. See module documentation.
+FIELD_ATTRS = {'width': None,
+               'style': 'normal',
+               'shortcut': None,
+               'format': None,
+               'return': True}
+
+# Entry attributes and their default values. See module documentation.
+ITEM_ATTRS = {'_level': 0,
+              '_critical': False}
+
+# Where the preview pane can be shown
+PREVIEW_POSITIONS = ('bottom', 'right')
+
+
+class NoSpace(Exception):
+    """Raised if there isn't enough space to display a column"""
+    pass
+
+
+class Theme:
+    DEFAULT = {'focused': ('white', 'dark blue'),
+               'critical': ('dark red', ''),
+               'normal': ('dark blue', ''),
+               'trivial': ('', ''),
+               'match': ('light red,bold', ''),
+               'misc': ('', '')}
+    COMPANION_SUFFIX = '_non_text'
+    FOCUSED_MATCH = 'focused_match'
+
+    def __init__(self, theme={}):
+        self.theme = sanitize_input(theme, self.DEFAULT)
+        self.create_focused_match()
+        self.create_companions()
+
+    def create_focused_match(self):
+        # Matched text in the focused item is shown in 'match' style's
+        # foreground color, but on 'focused' style's background color, so
+        # that the focused item is still shown as a whole.
+        fg, _ = self.theme['match']
+        _, bg = self.theme['focused']
+        self.theme[self.FOCUSED_MATCH] = (fg, bg)
+
+    def create_companions(self):
+        # A style applies to all characters in a column, including the
+        # 'blank space' (they are not blank, but padded with blank space
+        # characters). So, if a style contains 'underline' attribute,
+        # spaces in the column are also underlined. That causes the UI
+        # ugly. To address this issue, for each style containing
+        # 'underline' attribute, a companion style is created for it,
+        # which has 'underline' removed. These companion styles are used
+        # for displaying non-text characters (e.g., space, indicator,
+        # etc.) in the column.
+        for k, v in self.theme.copy().items():
+            fg, bg = v
+            if 'underline' in fg:
+                new_fg = ','.join([i for i in fg.split(',')
+                                   if i.strip() != 'underline'])
+                # Add a companion for this style
+                self.theme[k + self.COMPANION_SUFFIX] = (new_fg, bg)
+
+    def get_companion(self, style):
+        companion = style + self.COMPANION_SUFFIX
+        if companion in self.theme:
+            return companion
+        return style
+
+    def get_match(self, style):
+        if style == 'focused':
+            return self.FOCUSED_MATCH
+        return 'match'
+
+    def get_palette(self):
+        palette = []
+        for name, value in self.theme.items():
+            fg, bg = value
+            palette.append((name, fg, bg))
+        return palette
+
+
+def format_value(value, format=None):
+    """Return the text of a field value shown in UI.
+
+    Args:
+        value (object): The value. '' (used for a missing field or an
+            empty list) is shown as is, without calling format.
+        format (callable): The field's 'format' attribute. If it's None,
+            str() is used.
+    """
+    if isinstance(value, str) and not value:
+        return ''
+    if format:
+        return format(value)
+    return str(value)
+
+
+def sanitize_input(user_input, spec):
+    # Check unknown keys
+    for name in user_input.keys():
+        if name not in spec.keys():
+            raise ValueError('Unknown key: %s in %s' %
+                             (name, user_input))
+
+    # Add missing items with their default values
+    d = user_input.copy()
+    for name, value in spec.items():
+        if name not in d:
+            d[name] = value
+    return d
+
+
+def set_theme(new_theme):
+    """Set a custom theme.
+
+    Args:
+        theme (dict): A dict containing text style name/value pairs.
+            Text style value is a tuple containing fg/bg colors.
+
+    For more details see Theme section in 'pydoc3 pypick' command output.
+    """
+    global theme
+    theme = Theme(new_theme)
+
+
+theme = Theme()
@@ -0,0 +1,232 @@
+# Copyright (C) 2019 by Huan Xiong. All Rights Reserved.
+# Licensed under GPLv3 or later. See LICENSE file under top level directory.
+
+"""
+Matching data entries against a query. This module doesn't depend on
+urwid, so it's used both by the UI and by Pick.query().
+"""
+
+import collections
+import threading
+
+from . import common
+
+
+class Matcher:
+    """
+    A Matcher instance matches text against a query. A query consists of
+    terms separated by whitespace. Text matches the query if it contains
+    all the terms. Matching is case-insensitive.
+
+    Args:
+        query (str): The query string.
+    """
+    def __init__(self, query):
+        self.query = query
+        # Check longer terms first, as they are less likely to match.
+        self.terms = sorted(set(query.lower().split()), key=len,
+                            reverse=True)
+
+    def match(self, text):
+        """Return True if text matches the query.
+
+        Args:
+            text (str): Lower case text.
+        """
+        for term in self.terms:
+            if term not in text:
+                return False
+        return True
+
+    def spans(self, text):
+        """Return where the terms are in text.
+
+        Args:
+            text (str): Text to search.
+
+        Returns:
+            list: A sorted list of (start, end) tuples. Each is the range
+                of characters of one or more terms. Ranges don't overlap.
+        """
+        lower = text.lower()
+        # Lowering some characters changes the length of the text, in
+        # which case the positions don't apply to the original text.
+        if len(lower) != len(text):
+            return []
+        found = []
+        for term in self.terms:
+            start = lower.find(term)
+            while start >= 0:
+                found.append((start, start + len(term)))
+                start = lower.find(term, start + 1)
+        found.sort()
+        spans = []
+        for start, end in found:
+            if spans and start <= spans[-1][1]:
+                if end > spans[-1][1]:
+                    spans[-1] = (spans[-1][0], end)
+            else:
+                spans.append((start, end))
+        return spans
+
+
+class Index:
+    """
+    An Index instance finds entries matching a query.
+
+    The index maps each trigram (substring of three characters) in an
+    entry's text to the positions of entries containing it. A term can
+    only be in an entry containing all of the term's trigrams, so only
+    entries in the shortest of these lists (intersected with the second
+    shortest one if it's long) need to be matched.
+
+    Entries are indexed when searching. Entries appended to the list
+    after the index is created are indexed on next search. It's safe
+    to search from multiple threads.
+
+    Args:
+        entries (list): A list of data entries. The index keeps a
+            reference to it.
+        fields (list): Names of the fields to search.
+        field_attrs (dict of dict): Attributes of the fields. A field's
+            'format' attribute converts its values to the text searched,
+            so that it's the same as the text shown in UI.
+    """
+    GRAM = 3
+    # When all matched entries are needed, the shortest posting list is
+    # intersected with the second shortest one if it's longer than
+    # INTERSECT_MIN, and the second shortest one is at most INTERSECT_RATIO
+    # times as long, in which case it's cheaper than matching all the
+    # entries in the shortest list.
+    INTERSECT_MIN = 16
+    INTERSECT_RATIO = 4
+
+    def __init__(self, entries, fields, field_attrs={}):
+        self.entries = entries
+        self.fields = fields
+        self.formats = [field_attrs.get(field, {}).get('format')
+                        for field in fields]
+        self.texts = []
+        self.grams = {}
+        self.lock = threading.Lock()
+
+    def get_text(self, entry):
+        # Use a separator which isn't in any term, so that a term can't
+        # match across fields.
+        values = []
+        # Values are converted to text in the same way as ui.Column does.
+        for field, format in zip(self.fields, self.formats):
+            value = entry.get(field, '')
+            if isinstance(value, list):
+                values.extend(common.format_value(v, format) for v in value)
+            else:
+                values.append(common.format_value(value, format))
+        return '\n'.join(values).lower()
+
+    def update(self):
+        # Must be called with self.lock held
+        n = self.GRAM
+        for index in range(len(self.texts), len(self.entries)):
+            text = self.get_text(self.entries[index])
+            self.texts.append(text)
+            for gram in set(text[i:i + n] for i in range(len(text) - n + 1)):
+                postings = self.grams.get(gram)
+                if postings is None:
+                    self.grams[gram] = [index]
+                else:
+                    postings.append(index)
+
+    def postings(self, terms, intersect=True):
+        # Return positions of the entries which may contain all the
+        # terms, in ascending order. None means no term is long enough
+        # to narrow the search.
+        n = self.GRAM
+        lists = sorted((self.grams.get(term[i:i + n], [])
+                        for term in terms
+                        for i in range(len(term) - n + 1)), key=len)
+        if not lists:
+            return None
+        shortest = lists[0]
+        if intersect and len(lists) > 1 and \
+                len(shortest) > self.INTERSECT_MIN and \
+                len(lists[1]) <= len(shortest) * self.INTERSECT_RATIO:
+            shortest = sorted(set(shortest).intersection(lists[1]))
+        return shortest
+
+    def hits(self, term, cache):
+        # Return positions of the entries containing the term
+        result = cache.get(term)
+        if result is None:
+            candidates = self.postings([term])
+            if candidates is None:
+                candidates = range(len(self.texts))
+            texts = self.texts
+            result = cache[term] = [i for i in candidates if term in texts[i]]
+        return result
+
+    def verify(self, matcher, candidates, limit):
+        result = []
+        texts = self.texts
+        for index in candidates:
+            if limit is not None and len(result) >= limit:
+                break
+            if matcher.match(texts[index]):
+                result.append(index)
+        return result
+
+    def search(self, matcher, limit=None):
+        """Search entries matching the query.
+
+        Args:
+            matcher (Matcher): Matcher of the query.
+            limit (int): Maximum number of entries to return. No limit
+                if it's None.
+
+        Returns:
+            list: Positions of the matched entries, in ascending order.
+        """
+        with self.lock:
+            self.update()
+            candidates = self.postings(matcher.terms, limit is None)
+            if candidates is None:
+                candidates = range(len(self.texts))
+            return self.verify(matcher, candidates, limit)
+
+    def search_many(self, matchers, limit=None):
+        """Search entries matching each of a batch of queries.
+
+        Entries containing a term shared by multiple queries are found
+        only once for the batch, so it's faster than calling search()
+        for each query.
+
+        Args:
+            matchers (list of Matcher): Matchers of the queries.
+            limit (int): See search().
+
+        Returns:
+            list: The result of search() for each query.
+        """
+        results = []
+        with self.lock:
+            self.update()
+            counts = collections.Counter(term for matcher in matchers
+                                         for term in matcher.terms)
+            cache = {}
+            for matcher in matchers:
+                if not matcher.terms:
+                    results.append(list(range(len(self.texts))[:limit]))
+                elif limit is not None and \
+                        all(counts[term] == 1 for term in matcher.terms):
+                    # Stop at the limit, as no other query uses the terms
+                    candidates = self.postings(matcher.terms, limit is None)
+                    if candidates is None:
+                        candidates = range(len(self.texts))
+                    results.append(self.verify(matcher, candidates, limit))
+                else:
+                    hits = min((self.hits(term, cache)
+                                for term in matcher.terms), key=len)
+                    if len(matcher.terms) == 1:
+                        results.append(hits[:limit])
+                    else:
+                        results.append(self.verify(matcher, hits, limit))
+        return results
@@ -1,7 +1,10 @@
 # Copyright (C) 2019 by Huan Xiong. All Rights Reserved.
 # Licensed under GPLv3 or later. See LICENSE file under top level directory.
 
-from . import ui
+import threading
+
+from . import common
+from . import match
 
 
 class Pick:
@@ -20,15 +23,32 @@ class Pick:
         field_attrs (dict of dict): Describing UI attributes of the fields
             shown in UI. Each item describes one field. Item name is field
             name, item value is dictionary containing field attributes.
+        refresh_rate (int): Maximum number of times per second the UI is
+            updated for entries added by other threads while it's running.
+        preview (callable): If it's set, a preview pane shows the text it
+            returns for the entry being focused. It's called with the
+            entry's data in a background thread. See preview in module
+            documentation.
+        preview_position (str): Where to show the preview pane, 'bottom'
+            or 'right'.
+        group_by (str): Name of a field. If it's set, entries are put into
+            groups by the field's value. See Pick.add_entries().
+        group_sort (callable): Key function to sort the groups created by
+            group_by. It's called with the field's value. If it's None,
+            the groups are in the order their values first appear.
 
     Raises:
         ValueError: Raised if argument value is valid.
         NoSpace: Raised if there isn't enough space to display a column.
     """
-    def __init__(self, fields, extra_fields=[], field_attrs={}):
+    def __init__(self, fields, extra_fields=[], field_attrs={},
+                 refresh_rate=10, preview=None, preview_position='bottom',
+                 group_by=None, group_sort=None):
         # Check user input
         # 1) fields and extra_fields shouldn't have same item.
         # 2) field_attrs shoud contain only attrs for items in fields.
+        # 3) refresh_rate should be positive.
+        # 4) preview_position should be a valid position.
         for i in fields:
             if i in extra_fields:
                 raise ValueError("'%s' shouldn't be in both fields and "
@@ -37,11 +57,27 @@ class Pick:
             if i not in fields:
                 raise ValueError("fields doesn't have '%s', but field_attrs "
                                  "defines attrs for it" % i)
+        if not refresh_rate > 0:
+            raise ValueError("refresh_rate should be positive, but it's %s"
+                             % refresh_rate)
+        if preview_position not in common.PREVIEW_POSITIONS:
+            raise ValueError("Invalid preview position: %s" %
+                             preview_position)
         self.fields = fields
         self.extra_fields = extra_fields
         self.field_attrs = field_attrs
+        self.refresh_rate = refresh_rate
+        self.preview = preview
+        self.preview_position = preview_position
+        self.group_by = group_by
+        self.group_sort = group_sort
         self.groups = []
         self.create_group(Group.DEFAULT_GROUP)
+        # Groups created by group_by, indexed by (field, value)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._feed = None
+        self._list = None
 
     def create_group(self, name, fields_spec=None):
         """ Create a group.
@@ -66,27 +102,192 @@ class Pick:
         self.groups.append(g)
         return g
 
-    def add_entries(self, entries):
+    def add_entries(self, entries, group_by=None):
         """Add entries.
 
+        It's safe to call this method from other threads, including
+        when run() is running. See Group.add_entries().
+
         Args:
             entries (list): list of data. Its item is a dict representing
             a multi-field data.
+            group_by (str): Name of a field. It overrides Pick's group_by
+                argument. If it's set, entries are put into groups by the
+                field's value, one group for each value, which is named
+                after the value. The groups are created when needed.
+                If the field's value is a list, its first value is used.
+                Entries which don't have the field (or whose value is an
+                empty list) are added to the default group.
+        """
+        group_by = group_by or self.group_by
+        if not group_by:
+            self.groups[0].add_entries(entries)
+            return
+        # Put entries into buckets by the field's value in a single pass.
+        # Buckets contain references to the entries, not copies.
+        buckets = {}
+        for entry in entries:
+            value = entry.get(group_by)
+            # Group by the first value of a list, which is the one shown
+            # and returned by default.
+            if isinstance(value, list):
+                value = value[0] if value else None
+            bucket = buckets.get(value)
+            if bucket is None:
+                buckets[value] = [entry]
+            else:
+                bucket.append(entry)
+        for value, bucket in buckets.items():
+            if value is None:
+                self.groups[0].add_entries(bucket)
+            else:
+                self._get_bucket(group_by, value).add_entries(bucket)
+
+    def query(self, text, limit=None):
+        """Find entries matching a query without showing UI.
+
+        The query is made of terms separated by whitespace. An entry
+        matches it if the entry's fields shown in UI contain all the
+        terms (case-insensitively). For example, 'server root' matches
+        the entry in the usage example in module documentation.
+
+        Args:
+            text (str): The query.
+            limit (int): Maximum number of entries to return. No limit if
+                it's None.
+
+        Returns:
+            A list of dicts, each containing the fields of a matched data
+            entry, in the same format as run() returns. If a field has
+            multiple values, the first one is returned.
         """
-        default_group = self.groups[0]
-        default_group.add_entries(entries)
+        matcher = match.Matcher(text)
+        results = []
+        with self._lock:
+            groups = self._get_groups()
+        for g in groups:
+            if limit is not None:
+                if len(results) >= limit:
+                    break
+                results.extend(g._query(matcher, limit - len(results)))
+            else:
+                results.extend(g._query(matcher))
+        return results
 
-    def run(self):
+    def query_many(self, texts, limit=None):
+        """Run a batch of queries. See query().
+
+        It's faster than calling query() for each query. Duplicated
+        queries are run only once, each distinct term is searched only
+        once, and the dict of an entry matching multiple queries is
+        built only once. Note that means the results may share dicts.
+
+        Args:
+            texts (list of str): The queries.
+            limit (int): Maximum number of entries to return for each
+                query. No limit if it's None.
+
+        Returns:
+            A list containing the result of each query.
+        """
+        matchers = {}
+        for text in texts:
+            if text not in matchers:
+                matchers[text] = match.Matcher(text)
+        results = dict((text, []) for text in matchers)
+        with self._lock:
+            groups = self._get_groups()
+        for g in groups:
+            pending = [text for text in matchers
+                       if limit is None or len(results[text]) < limit]
+            if not pending:
+                break
+            hits = g._search_many([matchers[t] for t in pending], limit)
+            built = {}
+            for text, indexes in zip(pending, hits):
+                result = results[text]
+                if limit is not None:
+                    indexes = indexes[:limit - len(result)]
+                for i in indexes:
+                    entry = built.get(i)
+                    if entry is None:
+                        entry = built[i] = g._get_result(g.entries[i])
+                    result.append(entry)
+        return [results[text] for text in texts]
+
+    def run(self, multi_select=False):
         """Show data list in UI and wait for user to select an item
 
+        Args:
+            multi_select (bool): If it's True, user can select multiple
+                items. See multi-select mode in module documentation.
+
         Returns:
-            A dict containing fields of the data entry user selected.
+            A dict containing fields of the data entry user selected. In
+            multi-select mode, a read-only sequence of such dicts for the
+            data entries user selected, which compares equal to a list of
+            the same dicts. Note the dicts are built when they are
+            accessed, and list() converts it to a list (e.g., for
+            json.dumps()). None is returned if user quits without
+            selecting.
         """
+        ui = _import_ui()
+        feed = ui.Feed(self._receive, self.refresh_rate)
+        with self._lock:
+            self._feed = feed
+            groups = self._get_groups()
         group_widgets = []
-        for g in self.groups:
-            group_widgets.append(g._create_widget())
-        list = ui.List(group_widgets)
-        return ui.EventLoop(list).run()
+        for g in groups:
+            group_widgets.append(g._attach(feed))
+        self._list = ui.List(group_widgets, multi_select=multi_select)
+        preview = None
+        if self.preview:
+            preview = ui.Preview(self.preview, self.preview_position)
+        loop = ui.EventLoop(self._list, preview=preview)
+        feed.attach(loop)
+        try:
+            return loop.run()
+        finally:
+            with self._lock:
+                self._feed = None
+                groups = self._get_groups()
+            self._list = None
+            for g in groups:
+                g._detach()
+            feed.detach()
+
+    def _get_groups(self):
+        # Must be called with self._lock held
+        buckets = list(self._buckets.items())
+        if self.group_sort:
+            buckets.sort(key=lambda i: self.group_sort(i[0][1]))
+        return self.groups + [g for _, g in buckets]
+
+    def _get_bucket(self, field, value):
+        with self._lock:
+            g = self._buckets.get((field, value))
+            if g is None:
+                g = Group(str(value), self.fields, self.extra_fields,
+                          self.field_attrs)
+                # If UI is running, the group is shown when its entries
+                # are received in the main loop.
+                g._feed = self._feed
+                self._buckets[(field, value)] = g
+        return g
+
+    def _receive(self, batches):
+        for group, entries in batches:
+            if group._widget is None and self._list is not None:
+                self._show_group(group)
+            group._receive(entries)
+
+    def _show_group(self, group):
+        # Show a group created after UI started, in its sorted position.
+        with self._lock:
+            groups = self._get_groups()
+        preceding = groups[:groups.index(group)]
+        index = len([g for g in preceding if g._widget is not None])
+        self._list.insert_group(index, group._attach(self._feed))
 
 
 class Group:
@@ -113,39 +314,115 @@ class Group:
         self.extra_fields = extra_fields
         self.field_attrs = field_attrs
         self.entries = []
+        self._lock = threading.Lock()
+        self._feed = None
+        self._widget = None
+        self._index = None
 
     def add_entries(self, entries):
         """Add entries to the group.
 
+        It's safe to call this method from other threads. If the UI is
+        running, entries are queued and added to the UI in batches by
+        the main loop.
+
         Args:
             entries (list): list of data. Its item is a dict representing
             a multi-field data.
         """
-        self.entries.extend(entries)
+        feed = self._feed
+        if feed is None:
+            with self._lock:
+                feed = self._feed
+                if feed is None:
+                    self.entries.extend(entries)
+                    return
+        # Queue a copy, so that the caller can reuse its list.
+        feed.put((self, list(entries)))
 
-    def _create_widget(self):
-        item_widgets = []
-        # Create an Item widget for each entry, then use them to create
-        # a Group widget.
-        for entry in self.entries:
-            columns = []
-            columns_hidden = {}
-            # Process fields shown in UI
-            for field in self.fields:
+    def _attach(self, feed):
+        with self._lock:
+            self._widget = self._create_widget()
+            self._feed = feed
+        return self._widget
+
+    def _detach(self):
+        with self._lock:
+            self._feed = None
+            self._widget = None
+
+    def _receive(self, entries):
+        with self._lock:
+            self.entries.extend(entries)
+        if self._widget:
+            self._widget.add_items([None] * len(entries))
+
+    def _get_index(self):
+        # The same index is used by UI and Pick.query()
+        with self._lock:
+            if self._index is None:
+                self._index = match.Index(self.entries, self.fields,
+                                          self.field_attrs)
+            return self._index
+
+    def _search(self, matcher, limit=None):
+        return self._get_index().search(matcher, limit)
+
+    def _search_many(self, matchers, limit=None):
+        return self._get_index().search_many(matchers, limit)
+
+    def _query(self, matcher, limit=None):
+        return [self._get_result(self.entries[i])
+                for i in self._search(matcher, limit)]
+
+    def _get_result(self, entry):
+        # Build the result in the same way as ui.Item.keypress() does
+        # for an Item whose columns show their first values.
+        result = dict((f, entry.get(f, '')) for f in self.extra_fields)
+        for field in self.fields:
+            attrs = self.field_attrs.get(field, {})
+            if attrs.get('return', common.FIELD_ATTRS['return']):
                 value = entry.get(field, '')
-                attrs = self.field_attrs.get(field, {})
-                columns.append((field, value, attrs))
-            # Process extra fields that are not shown
-            for field in self.extra_fields:
-                columns_hidden[field] = entry.get(field, '')
-            item_attrs = dict((k, v) for k, v in entry.items()
-                              if self._is_item_attr(k))
-            item = ui.Item(columns, columns_hidden, item_attrs)
-            item_widgets.append(item)
-        if self.name == self.DEFAULT_GROUP:
-            return ui.Group(item_widgets)
-        else:
-            return ui.Group(item_widgets, name=self.name)
+                if isinstance(value, list):
+                    value = value[0] if value else ''
+                result[field] = value
+        return result
+
+    def _create_widget(self):
+        # Item widgets are created when they are shown. See ui.Group.
+        ui = _import_ui()
+        items = [None] * len(self.entries)
+        name = None if self.name == self.DEFAULT_GROUP else self.name
+        return ui.Group(items, name=name, search=self._search,
+                        create_item=self._create_item,
+                        create_result=self._create_result)
+
+    def _create_result(self, index):
+        return self._get_result(self.entries[index])
+
+    def _create_item(self, index):
+        entry = self.entries[index]
+        columns = []
+        columns_hidden = {}
+        # Process fields shown in UI
+        for field in self.fields:
+            value = entry.get(field, '')
+            attrs = self.field_attrs.get(field, {})
+            columns.append((field, value, attrs))
+        # Process extra fields that are not shown
+        for field in self.extra_fields:
+            columns_hidden[field] = entry.get(field, '')
+        item_attrs = dict((k, v) for k, v in entry.items()
+                          if self._is_item_attr(k))
+        return _import_ui().Item(columns, columns_hidden, item_attrs,
+                                 data=entry)
 
     def _is_item_attr(self, name):
-        return name in [i for i in ui.Item.ATTRS]
+        return name in common.ITEM_ATTRS
+
+
+def _import_ui():
+    # Import ui (and hence urwid) only when UI is shown, so that scripts
+    # calling Pick.query() don't load it.
+    from . import ui
+    return ui
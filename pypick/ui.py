@@ -1,59 +1,22 @@
 # Copyright (C) 2019 by Huan Xiong. All Rights Reserved.
 # Licensed under GPLv3 or later. See LICENSE file under top level directory.
 
+import collections
+import collections.abc
+import concurrent.futures
+import os
 import signal
 import sys
+import threading
+import time
 import urwid
 from wcwidth import wcswidth
 
-
-class NoSpace(Exception):
-    """Raised if there isn't enough space to display a column"""
-    pass
-
-
-class Theme:
-    DEFAULT = {'focused': ('white', 'dark blue'),
-               'critical': ('dark red', ''),
-               'normal': ('dark blue', ''),
-               'trivial': ('', ''),
-               'misc': ('', '')}
-    COMPANION_SUFFIX = '_non_text'
-
-    def __init__(self, theme={}):
-        self.theme = sanitize_input(theme, self.DEFAULT)
-        self.create_companions()
-
-    def create_companions(self):
-        # A style applies to all characters in a column, including the
-        # 'blank space' (they are not blank, but padded with blank space
-        # characters). So, if a style contains 'underline' attribute,
-        # spaces in the column are also underlined. That causes the UI
-        # ugly. To address this issue, for each style containing
-        # 'underline' attribute, a companion style is created for it,
-        # which has 'underline' removed. These companion styles are used
-        # for displaying non-text characters (e.g., space, indicator,
-        # etc.) in the column.
-        for k, v in self.theme.copy().items():
-            fg, bg = v
-            if 'underline' in fg:
-                new_fg = ','.join([i for i in fg.split(',')
-                                   if i.strip() != 'underline'])
-                # Add a companion for this style
-                self.theme[k + self.COMPANION_SUFFIX] = (new_fg, bg)
-
-    def get_companion(self, style):
-        companion = style + self.COMPANION_SUFFIX
-        if companion in self.theme:
-            return companion
-        return style
-
-    def get_palette(self):
-        palette = []
-        for name, value in self.theme.items():
-            fg, bg = value
-            palette.append((name, fg, bg))
-        return palette
+from . import common
+from . import match
+# Theme and set_theme() were defined here. They're still exported for
+# compatibility.
+from .common import NoSpace, Theme, sanitize_input, set_theme  # noqa: F401
 
 
 class Column:
@@ -70,13 +33,12 @@ class Column:
              may pass a list of values.
          column_attrs (dict): a dict containing this field's attributes.
     """
-    ATTRS = {'width': None,
-             'style': 'normal',
-             'shortcut': None,
-             'return': True}
+    ATTRS = common.FIELD_ATTRS
     SPACE = ' '
     LIST_INDICATOR = '▾'
     LEVEL_INDICATOR = '⤷'
+    SELECTED_INDICATOR = '✓'
+    POPUP_THRESHOLD = 10
 
     def __init__(self, item, index, name, value_candidates, column_attrs):
         self.item = item
@@ -84,31 +46,68 @@ class Column:
         self.name = name
         self.value_candidates = value_candidates
         self.value_index = 0
+        # Text of the values which have been shown, indexed by value_index.
+        # It's created when the column is rendered the first time.
+        self.texts = None
+        # Ranges of the text matching the item's query (see get_spans())
+        self.spans_key = None
+        self.spans = None
 
         column_attrs = sanitize_input(column_attrs, self.ATTRS)
         self.width = column_attrs['width']
         self.style = column_attrs['style']
         self.shortcut = column_attrs['shortcut']
+        self.format = column_attrs['format']
         self.will_return = column_attrs['return']
 
-        # Calculate value and shortcut. Shortcut is set only when
-        # 1) user sets it, _and_ 2) the field value is a list containing
-        # more than one items.
+        # Calculate shortcut. Shortcut is set only when 1) user sets it,
+        # _and_ 2) the field value is a list containing more than one
+        # items.
         shortcut = self.shortcut
         self.shortcut = None
+        if isinstance(value_candidates, list) and len(value_candidates) > 1:
+            self.shortcut = shortcut
+            # Assign a default shortcut based on column name if user
+            # doesn't specify one.
+            if not self.shortcut:
+                self.shortcut = self.name[0]
+
+    @property
+    def value(self):
+        """The column's current (raw, unformatted) value."""
         if isinstance(self.value_candidates, list):
-            if value_candidates:
-                self.value = str(value_candidates[0])
-                if len(value_candidates) > 1:
-                    self.shortcut = shortcut
-                    # Assign a default shortcut based on column name
-                    # if user doesn't specify one.
-                    if not self.shortcut:
-                        self.shortcut = self.name[0]
+            if not self.value_candidates:
+                return ''
+            return self.value_candidates[self.value_index]
+        return self.value_candidates
+
+    def get_text(self, index=None):
+        """Return the text of the column's current value.
+
+        The value is converted to text by common.format_value() when it's
+        shown the first time. The result is
+        memoized, so a value is formatted only once no matter how many
+        times it's rendered.
+
+        Args:
+            index (int): If it's set, return the text of the value at the
+                index in value candidates instead.
+        """
+        if index is None:
+            index = self.value_index
+        if self.texts is None:
+            self.texts = {}
+        text = self.texts.get(index)
+        if text is None:
+            candidates = self.value_candidates
+            if not isinstance(candidates, list):
+                text = common.format_value(candidates, self.format)
+            elif candidates:
+                text = common.format_value(candidates[index], self.format)
             else:
-                self.value = ''
-        else:
-            self.value = str(value_candidates)
+                text = ''
+            self.texts[index] = text
+        return text
 
     def chop_text(self, u, width):
         """
@@ -123,10 +122,26 @@ class Column:
         Returns:
             str: A substr that meets with the width limit.
         """
+        if get_width(u, u.encode()) == len(u):
+            return u[:max(width, 0)]
         while len(u) > 0 and wcswidth(u) > width:
             u = u[0:-1]
         return u
 
+    def get_spans(self, text):
+        """Return ranges of characters in text matching the item's query.
+
+        The result is memoized until the query or the value changes.
+        """
+        matcher = self.item.matcher
+        if matcher is None:
+            return []
+        key = (matcher, self.value_index)
+        if self.spans_key != key:
+            self.spans_key = key
+            self.spans = matcher.spans(text)
+        return self.spans
+
     def get_text_and_attrs(self, focus=False, width=0):
         """Return text to be displayed in this column.
 
@@ -141,18 +156,29 @@ class Column:
         """
         text = []
         attrs = []
+        used = 0
 
         def _create_text_and_attrs(snippet, style):
-            text_width = sum([wcswidth(t) for t in text])
-            if text_width + wcswidth(snippet) >= width:
-                snippet = self.chop_text(snippet, width - text_width - 1)
-                if snippet:
-                    text.append(snippet)
-                    attrs.append((style, len(snippet)))
+            nonlocal used
+            # Urwid TextCanvas accepts bytes, and attributes are run
+            # lengths in bytes. Encode each snippet once and merge its run
+            # into the previous one if they have the same style.
+            snippet_b = snippet.encode()
+            snippet_width = get_width(snippet, snippet_b)
+            no_space = used + snippet_width >= width
+            if no_space:
+                snippet = self.chop_text(snippet, width - used - 1)
+                snippet_b = snippet.encode()
+                snippet_width = get_width(snippet, snippet_b)
+            if snippet:
+                text.append(snippet_b)
+                used += snippet_width
+                if attrs and attrs[-1][0] == style:
+                    attrs[-1] = (style, attrs[-1][1] + len(snippet_b))
+                else:
+                    attrs.append((style, len(snippet_b)))
+            if no_space:
                 raise NoSpace()
-            else:
-                text.append(snippet)
-                attrs.append((style, len(snippet)))
 
         # Determine the style (fg/bg colors) to render the column's text
         # 1) Get it from user input (or use default)
@@ -165,20 +191,34 @@ class Column:
         if focus:
             style = 'focused'
         # Theme is a global variable.
-        companion_style = theme.get_companion(style)
+        companion_style = common.theme.get_companion(style)
+        match_style = common.theme.get_match(style)
 
         # Generate text and its run-length encoded attributes
         try:
-            # 1) Add two leading spaces in the first colum of an item
-            if not self.index:
+            # 1) Add two leading spaces in the first colum of an item, or
+            # an indicator if the item is selected in multi-select mode.
+            if not self.index and self.item.selected:
+                _create_text_and_attrs(self.SELECTED_INDICATOR + self.SPACE,
+                                       companion_style)
+            elif not self.index:
                 _create_text_and_attrs(self.SPACE * 2, companion_style)
             # 2) Indent the text of the first column of a child item
             if self.item.get_level() and not self.index:
                 indent = self.SPACE * self.item.get_level() * 2 + \
                     self.LEVEL_INDICATOR + self.SPACE
                 _create_text_and_attrs(indent, companion_style)
-            # 3) Add the column's value
-            _create_text_and_attrs(self.value, style)
+            # 3) Add the column's value, highlighting the parts matching
+            # the query.
+            value = self.get_text()
+            start = 0
+            for begin, end in self.get_spans(value):
+                if begin > start:
+                    _create_text_and_attrs(value[start:begin], style)
+                _create_text_and_attrs(value[begin:end], match_style)
+                start = end
+            if start < len(value):
+                _create_text_and_attrs(value[start:], style)
             # 4) Append an indicator if it has multiple values
             if self.shortcut:
                 _create_text_and_attrs(self.LIST_INDICATOR, companion_style)
@@ -186,19 +226,15 @@ class Column:
             pass
         finally:
             # 5) Add Padding
-            size = width - sum([wcswidth(t) for t in text])
+            size = width - used
             if size:
-                text.append(self.SPACE * size)
-                attrs.append((companion_style, size))
+                text.append(self.SPACE.encode() * size)
+                if attrs and attrs[-1][0] == companion_style:
+                    attrs[-1] = (companion_style, attrs[-1][1] + size)
+                else:
+                    attrs.append((companion_style, size))
 
-        # Urwid TextCanvas accepts bytes, instead of unicode string
-        text_b = bytearray()
-        for index, snippet in enumerate(text):
-            snippet_b = snippet.encode()
-            text_b.extend(snippet_b)
-            style, _ = attrs[index]
-            attrs[index] = (style, len(snippet_b))
-        return bytes(text_b), attrs
+        return b''.join(text), attrs
 
     def update_value(self):
         """Get the next value in value list and set column value to it.
@@ -206,7 +242,14 @@ class Column:
            The function is called only if self.shortcut is not None.
         """
         self.value_index = (self.value_index + 1) % len(self.value_candidates)
-        self.value = self.value_candidates[self.value_index]
+
+    def has_popup(self):
+        """Return True if the shortcut opens a popup to choose value.
+
+        Pressing the shortcut iterates over the values, unless there are
+        too many of them, in which case a searchable popup is shown.
+        """
+        return len(self.value_candidates) > self.POPUP_THRESHOLD
 
 
 class Item(urwid.Widget):
@@ -225,16 +268,23 @@ class Item(urwid.Widget):
         hidden_columns (dict): A dict containing non-displayed field
             name/value pairs.
         item_attrs (dict): A dict containing the data entry's attributes.
+        data (object): The data entry. It's passed to preview callback.
 
     Raises:
         NoSpace: Raised if there isn't enough space to show columns.
     """
     _sizing = frozenset(['flow'])
-    ATTRS = {'_level': 0,
-             '_critical': False}
+    ATTRS = common.ITEM_ATTRS
 
-    def __init__(self, columns, hidden_columns, item_attrs):
+    def __init__(self, columns, hidden_columns, item_attrs, data=None):
         super(Item, self).__init__()
+        self.data = data
+        # The Matcher of the query the item is filtered by. It's set by
+        # Group when the item is shown.
+        self.matcher = None
+        # If the item is selected in multi-select mode. It's also set by
+        # Group when the item is shown.
+        self.selected = False
         self.hidden_columns = hidden_columns
         self.item_attrs = sanitize_input(item_attrs, self.ATTRS)
         self.columns = self.create_columns(columns, item_attrs)
@@ -288,19 +338,25 @@ class Item(urwid.Widget):
     def keypress(self, size, key):
         global result
         if key in ('enter', ' '):
-            result = self.hidden_columns
-            for c in self.columns:
-                if c.will_return:
-                    result[c.name] = c.value
+            result = self.get_result()
             raise urwid.ExitMainLoop()
         else:
             c = self.get_column_by_shortcut(key)
-            if c:
+            # The popup is opened by EventLoop
+            if c and not c.has_popup():
                 c.update_value()
                 self._invalidate()
                 return
         return key
 
+    def get_result(self):
+        """Return a dict containing the fields to return."""
+        result = dict(self.hidden_columns)
+        for c in self.columns:
+            if c.will_return:
+                result[c.name] = c.value
+        return result
+
     def get_column_by_shortcut(self, key):
         for c in self.columns:
             if key == c.shortcut:
@@ -308,28 +364,233 @@ class Item(urwid.Widget):
         return None
 
 
-class Group(urwid.Pile):
-    def __init__(self, items, name=None):
-        blank = urwid.Text('')
-        title = urwid.AttrMap(urwid.Text('[ %s ]' % name), 'misc')
-        divider = urwid.AttrMap(urwid.Divider('-'), 'misc')
-        if name:
-            inner_widgets = [blank, title, divider] + items
+class Group:
+    """
+    A Group instance contains a list of Item widgets shown under a title.
+    It isn't a widget itself. Rows of all groups are shown in a single
+    ListBox by List, so that only rows on screen are rendered.
+
+    Args:
+        items (list): A list of Item widgets. If create_item is set, an
+            element in the list can be None, in which case the Item is
+            created when it's shown the first time.
+        name (str): Group name. The title isn't shown if it's None.
+        search (callable): Called with a match.Matcher instance, returns
+            indexes of the items matching the query in ascending order.
+            If it's None, the group isn't filtered by queries.
+        create_item (callable): Called with an item's index, returns the
+            Item widget.
+        create_result (callable): Called with an item's index, returns the
+            dict to return when the item is selected. It's used only for
+            items not created yet in multi-select mode.
+    """
+    def __init__(self, items, name=None, search=None, create_item=None,
+                 create_result=None):
+        self.name = name
+        self.items = list(items)
+        self.search = search
+        self.create_item = create_item
+        self.create_result = create_result
+        # Items selected in multi-select mode. It's a bitset: bit i is set
+        # if item i is selected.
+        self.selected = 0
+        self.walker = None
+        self.matcher = None
+        # Indexes of the items matching the query. All items are shown
+        # if it's None.
+        self.shown = None
+        # Bitset of the shown items, created when it's needed.
+        self.shown_mask = None
+        # The title widgets are also created when they're shown.
+        self.header = None
+        self.header_rows = 3 if name else 1
+
+    def __len__(self):
+        if self.shown is None:
+            return self.header_rows + len(self.items)
+        # Hide the group if no item matches the query
+        if not self.shown:
+            return 0
+        return self.header_rows + len(self.shown)
+
+    def __getitem__(self, index):
+        if index < self.header_rows:
+            return self.get_header()[index]
+        index -= self.header_rows
+        if self.shown is not None:
+            index = self.shown[index]
+        item = self.items[index]
+        if item is None:
+            item = self.items[index] = self.create_item(index)
+        # Only items on screen are updated when the query or the
+        # selection changes.
+        selected = bool(self.selected >> index & 1)
+        if item.matcher is not self.matcher or item.selected != selected:
+            item.matcher = self.matcher
+            item.selected = selected
+            item._invalidate()
+        return item
+
+    def get_index(self, row):
+        """Return index of the item shown in the given row."""
+        index = row - self.header_rows
+        if self.shown is not None:
+            index = self.shown[index]
+        return index
+
+    def get_result(self, index):
+        """Return the dict to return for item index."""
+        item = self.items[index]
+        if item is None:
+            return self.create_result(index)
+        return item.get_result()
+
+    def get_shown_mask(self):
+        """Return the bitset of the items shown."""
+        if self.shown is None:
+            return (1 << len(self.items)) - 1
+        if self.shown_mask is None:
+            bits = bytearray((len(self.items) + 7) // 8)
+            for i in self.shown:
+                bits[i >> 3] |= 1 << (i & 7)
+            self.shown_mask = int.from_bytes(bytes(bits), 'little')
+        return self.shown_mask
+
+    def get_range_mask(self, first, last):
+        """Return the bitset of the items shown from row first to last."""
+        if first > last:
+            return 0
+        start, end = self.get_index(first), self.get_index(last)
+        mask = (1 << (end + 1)) - (1 << start)
+        if self.shown is not None:
+            mask &= self.get_shown_mask()
+        return mask
+
+    def get_header(self):
+        if self.header is None:
+            blank = urwid.Text('')
+            if self.name:
+                title = urwid.AttrMap(urwid.Text('[ %s ]' % self.name),
+                                      'misc')
+                divider = urwid.AttrMap(urwid.Divider('-'), 'misc')
+                self.header = [blank, title, divider]
+            else:
+                self.header = [blank]
+        return self.header
+
+    def add_items(self, items):
+        """Append Item widgets to the group.
+
+        This must be called in the thread running the main loop.
+        """
+        self.items.extend(items)
+        if self.shown is not None:
+            self.shown = self.search(self.matcher)
+            self.shown_mask = None
+        if self.walker:
+            self.walker._modified()
+
+    def filter(self, matcher):
+        """Show only items matching a query.
+
+        Args:
+            matcher (match.Matcher): Matcher of the query. All items are
+                shown if it's None.
+        """
+        self.matcher = matcher
+        self.shown_mask = None
+        if matcher is None or self.search is None:
+            self.shown = None
         else:
-            inner_widgets = [blank] + items
-        super(Group, self).__init__(inner_widgets)
+            self.shown = self.search(matcher)
 
-        # Add VIM-like 'j' and 'k' key behavior
-        cmd_map = urwid.CommandMap().copy()
-        cmd_map['j'] = 'cursor down'
-        cmd_map['k'] = 'cursor up'
-        self._command_map = cmd_map
 
+class Walker(urwid.ListWalker):
+    """
+    A Walker instance supplies rows of all groups to List. A position
+    is a tuple of (group index, row index in the group).
 
-class List (urwid.ListBox):
+    Args:
+        groups (list): A list of Group instances.
+    """
     def __init__(self, groups):
-        it = urwid.SimpleListWalker(groups)
-        super(List, self).__init__(it)
+        self.groups = groups
+        for g in groups:
+            g.walker = self
+        self.reset_focus()
+
+    def reset_focus(self):
+        # Focus the first row. Note a group may have no row.
+        self.focus = None
+        for index, g in enumerate(self.groups):
+            if len(g):
+                self.focus = (index, 0)
+                break
+        self._modified()
+
+    def insert_group(self, index, group):
+        self.groups.insert(index, group)
+        group.walker = self
+        if self.focus is None:
+            self.reset_focus()
+            return
+        g, r = self.focus
+        if g >= index:
+            self.focus = (g + 1, r)
+        self._modified()
+
+    def get_focus(self):
+        if self.focus is None:
+            return None, None
+        g, r = self.focus
+        return self.groups[g][r], self.focus
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        g, r = position
+        r += 1
+        while r >= len(self.groups[g]):
+            g, r = g + 1, 0
+            if g >= len(self.groups):
+                return None, None
+        return self.groups[g][r], (g, r)
+
+    def get_prev(self, position):
+        g, r = position
+        r -= 1
+        while r < 0:
+            g -= 1
+            if g < 0:
+                return None, None
+            r = len(self.groups[g]) - 1
+        return self.groups[g][r], (g, r)
+
+
+class List (urwid.ListBox):
+    """
+    A List instance shows rows of groups.
+
+    Args:
+        groups (list): A list of Group instances.
+        multi_select (bool): In multi-select mode, user selects items
+            with the following keys, then press 'enter' to return them:
+
+            ' ': Select or deselect the focused item.
+            '+': Select all items shown.
+            '-': Deselect all items shown.
+            '*': Invert selection of the items shown.
+            '=': Select items between the last item selected or
+                 deselected by ' ' and the focused item.
+    """
+    def __init__(self, groups, multi_select=False):
+        self.matcher = None
+        self.multi_select = multi_select
+        # Position of the last item toggled by ' '
+        self.anchor = None
+        super(List, self).__init__(Walker(groups))
 
         # Add VIM-like 'j' and 'k' key behavior
         cmd_map = urwid.CommandMap().copy()
@@ -337,52 +598,548 @@ class List (urwid.ListBox):
         cmd_map['k'] = 'cursor up'
         self._command_map = cmd_map
 
+    def render(self, size, focus=False):
+        # Items may be added after the list is shown (see Feed). If no
+        # item was focused, focus the first one when it shows up.
+        widget, _ = self.body.get_focus()
+        if widget is not None and not widget.selectable():
+            self.set_focus_pending = 'first selectable'
+        return super(List, self).render(size, focus=focus)
+
+    def keypress(self, size, key):
+        global result
+        if not self.multi_select:
+            return super(List, self).keypress(size, key)
+        groups = self.body.groups
+        _, position = self.body.get_focus()
+        focused = self.get_focus_item() is not None
+        if key == ' ' and focused:
+            g, r = position
+            groups[g].selected ^= 1 << groups[g].get_index(r)
+            self.anchor = position
+        elif key == '+':
+            for g in groups:
+                g.selected |= g.get_shown_mask()
+        elif key == '-':
+            for g in groups:
+                g.selected &= ~g.get_shown_mask()
+        elif key == '*':
+            for g in groups:
+                g.selected ^= g.get_shown_mask()
+        elif key == '=' and focused and self.anchor:
+            self.select_range(self.anchor, position)
+        elif key == 'enter' and focused:
+            result = Selection(groups)
+            if not result:
+                g, r = position
+                groups[g].selected |= 1 << groups[g].get_index(r)
+            raise urwid.ExitMainLoop()
+        elif key not in (' ', '=', 'enter'):
+            return super(List, self).keypress(size, key)
+        self.body._modified()
+
+    def select_range(self, start, end):
+        start, end = min(start, end), max(start, end)
+        groups = self.body.groups
+        for index in range(start[0], end[0] + 1):
+            g = groups[index]
+            if not len(g):
+                continue
+            first = start[1] if index == start[0] else 0
+            last = end[1] if index == end[0] else len(g) - 1
+            g.selected |= g.get_range_mask(max(first, g.header_rows), last)
+
+    def set_query(self, query):
+        """Show only items matching a query. See match.Matcher."""
+        matcher = match.Matcher(query) if query.strip() else None
+        self.matcher = matcher
+        self.anchor = None
+        for g in self.body.groups:
+            g.filter(matcher)
+        self.body.reset_focus()
+        self.set_focus_pending = 'first selectable'
+
+    def insert_group(self, index, group):
+        """Show a Group at the given position in the list of groups."""
+        group.filter(self.matcher)
+        self.anchor = None
+        self.body.insert_group(index, group)
+
+    def get_focus_item(self):
+        widget, _ = self.body.get_focus()
+        if isinstance(widget, Item):
+            return widget
+        return None
+
+
+class Selection(collections.abc.Sequence):
+    """
+    A Selection instance is a read-only sequence of the dicts of the
+    items selected in multi-select mode. A dict is built when it's
+    accessed. It compares equal to a list (or any other sequence) of the
+    same dicts.
+
+    Args:
+        groups (list): A list of Group instances.
+    """
+    def __init__(self, groups):
+        self.groups = groups
+        self.indexes = None
+
+    def __len__(self):
+        return sum(bin(g.selected).count('1') for g in self.groups)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        group, item_index = self.get_indexes()[index]
+        return group.get_result(item_index)
+
+    def __iter__(self):
+        for group, item_index in self.get_indexes():
+            yield group.get_result(item_index)
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Sequence) or \
+                isinstance(other, (str, bytes)):
+            return NotImplemented
+        return len(self) == len(other) and \
+            all(a == b for a, b in zip(self, other))
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def get_indexes(self):
+        # Find the set bits of each bitset by searching its binary
+        # representation, which is done in C.
+        if self.indexes is None:
+            self.indexes = []
+            for g in self.groups:
+                bits = bin(g.selected)[:1:-1]
+                index = bits.find('1')
+                while index >= 0:
+                    self.indexes.append((g, index))
+                    index = bits.find('1', index + 1)
+        return self.indexes
+
+
+class Feed:
+    """
+    A Feed instance passes data from other threads to the main loop.
+    Other threads call put() to queue a batch of data. The batches are
+    drained in the main loop and passed to the handler. The handler is
+    called at most 'rate' times per second, so that a lot of small
+    batches don't cause the screen to be redrawn for each of them.
+
+    Args:
+        handler (callable): Called with a list of batches received.
+        rate (int): Maximum number of times the handler is called in
+            a second.
+    """
+    def __init__(self, handler, rate=10):
+        self.handler = handler
+        self.interval = 1.0 / rate
+        self.batches = collections.deque()
+        self.lock = threading.Lock()
+        self.loop = None
+        self.fd = None
+        self.alarm = None
+        self.signaled = False
+        self.closed = False
+        self.last = 0
+
+    def put(self, batch):
+        """Queue a batch of data. It's safe to call it from any thread.
+
+        Batches put before attach() are kept until the feed is attached.
+        Batches put after detach() are passed to the handler directly
+        in the calling thread.
+        """
+        # deque.append() is atomic, so producers don't need a lock. The
+        # main loop is woken up only once until the queue is drained.
+        self.batches.append(batch)
+        if self.closed:
+            self.handler(self.drain())
+        elif not self.signaled:
+            self.signaled = True
+            self.signal()
+
+    def signal(self):
+        with self.lock:
+            if self.fd is not None:
+                os.write(self.fd, b'.')
+
+    def drain(self):
+        batches = []
+        try:
+            while True:
+                batches.append(self.batches.popleft())
+        except IndexError:
+            pass
+        return batches
+
+    def attach(self, loop):
+        self.loop = loop
+        with self.lock:
+            self.fd = loop.watch_pipe(self.wakeup)
+        if self.batches:
+            self.signaled = True
+            self.signal()
+
+    def detach(self):
+        with self.lock:
+            self.loop.remove_watch_pipe(self.fd)
+            os.close(self.fd)
+            self.fd = None
+        if self.alarm:
+            self.loop.remove_alarm(self.alarm)
+            self.alarm = None
+        self.closed = True
+        batches = self.drain()
+        if batches:
+            self.handler(batches)
+
+    def wakeup(self, data):
+        wait = self.last + self.interval - time.monotonic()
+        if wait <= 0:
+            self.flush()
+        elif self.alarm is None:
+            self.alarm = self.loop.set_alarm_in(wait, self.flush)
+
+    def flush(self, loop=None, user_data=None):
+        self.alarm = None
+        self.last = time.monotonic()
+        # Reset the flag before draining the queue, so that a batch put
+        # after the queue is drained wakes up the main loop again.
+        self.signaled = False
+        batches = self.drain()
+        if batches:
+            self.handler(batches)
+
+
+class Preview(urwid.WidgetWrap):
+    """
+    A Preview instance shows the text generated by a user callback for
+    the item being focused.
+
+    The callback runs in a thread pool, so that it never blocks the UI.
+    It's called only after focus stays on an item for 'delay' seconds,
+    and its results are kept in a LRU cache keyed by item. When focus
+    moves on, the pending request for the previous item is cancelled.
+
+    Args:
+        callback (callable): Called with the focused item's data entry.
+            It returns a str.
+        position (str): Where to show the preview, 'bottom' or 'right'.
+        delay (float): See above.
+        cache_size (int): Maximum number of results in the cache.
+        workers (int): Number of threads to run the callback.
+    """
+    LOADING = '...'
+
+    def __init__(self, callback, position='bottom', delay=0.2,
+                 cache_size=256, workers=4):
+        if position not in common.PREVIEW_POSITIONS:
+            raise ValueError('Invalid preview position: %s' % position)
+        self.callback = callback
+        self.position = position
+        self.delay = delay
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.feed = Feed(self.receive)
+        self.loop = None
+        self.item = None
+        self.alarm = None
+        self.future = None
+        self.text = urwid.Text('')
+        box = urwid.LineBox(urwid.Filler(self.text, valign='top'))
+        super(Preview, self).__init__(urwid.AttrMap(box, 'misc'))
+
+    def attach(self, loop):
+        self.loop = loop
+        self.feed.attach(loop)
+
+    def detach(self):
+        self.cancel()
+        self.feed.detach()
+        self.loop = None
+        self.executor.shutdown(wait=False)
+
+    def show(self, item):
+        """Show preview of an item. Called when focus moves to it."""
+        if item is self.item:
+            return
+        self.cancel()
+        self.item = item
+        if item is None:
+            self.text.set_text('')
+        elif item in self.cache:
+            self.cache.move_to_end(item)
+            self.text.set_text(self.cache[item])
+        else:
+            self.text.set_text(self.LOADING)
+            # Debounce: don't start the request until user stops on
+            # the item.
+            self.alarm = self.loop.set_alarm_in(self.delay, self.request)
+
+    def cancel(self):
+        if self.alarm:
+            self.loop.remove_alarm(self.alarm)
+            self.alarm = None
+        if self.future:
+            # A running request can't be cancelled. Its result is still
+            # cached, but it isn't shown.
+            self.future.cancel()
+            self.future = None
+
+    def request(self, loop=None, user_data=None):
+        self.alarm = None
+        item = self.item
+        self.future = self.executor.submit(self.callback, item.data)
+        self.future.add_done_callback(
+            lambda future: self.feed.put((item, future)))
+
+    def receive(self, batches):
+        # Results which arrive after the UI exits are dropped.
+        if self.loop is None:
+            return
+        for item, future in batches:
+            if future.cancelled():
+                continue
+            try:
+                text = str(future.result())
+            except Exception as e:
+                text = 'Failed to get preview: %s' % e
+            self.cache[item] = text
+            self.cache.move_to_end(item)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            if item is self.item:
+                self.future = None
+                self.text.set_text(text)
+
+
+class Candidate(urwid.Text):
+    """A row in Popup showing a value candidate."""
+    _selectable = True
+
+    def keypress(self, size, key):
+        return key
+
+
+class CandidateWalker(urwid.ListWalker):
+    """
+    A CandidateWalker instance supplies rows of a column's value
+    candidates to Popup. A row is created when it's shown the first time.
+    A position is an index in the list of candidates matching the query.
+
+    Args:
+        column (Column): The column whose candidates are shown.
+    """
+    def __init__(self, column):
+        self.column = column
+        self.indexes = list(range(len(column.value_candidates)))
+        self.rows = {}
+        self.focus = 0
+
+    def get_row(self, position):
+        index = self.indexes[position]
+        row = self.rows.get(index)
+        if row is None:
+            text = Candidate(self.column.SPACE + self.column.get_text(index))
+            row = self.rows[index] = urwid.AttrMap(text, 'normal', 'focused')
+        return row
+
+    def set_indexes(self, indexes):
+        self.indexes = indexes
+        self.focus = 0
+        self._modified()
+
+    def get_focus(self):
+        if not self.indexes:
+            return None, None
+        return self.get_row(self.focus), self.focus
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        if position + 1 >= len(self.indexes):
+            return None, None
+        return self.get_row(position + 1), position + 1
+
+    def get_prev(self, position):
+        if position <= 0:
+            return None, None
+        return self.get_row(position - 1), position - 1
+
+
+class Popup(urwid.WidgetWrap):
+    """
+    A Popup instance lets user choose one of a column's value candidates.
+    User types a query to show only candidates matching it, moves focus
+    by 'up' and 'down' keys, and press 'enter' to choose the focused one
+    or 'esc' to cancel.
+
+    Args:
+        column (Column): The column to choose value for.
+        on_choose (callable): Called with the index of the chosen value.
+        on_cancel (callable): Called when user cancels.
+    """
+    NAVIGATION_KEYS = ('up', 'down', 'page up', 'page down', 'home', 'end')
+
+    def __init__(self, column, on_choose, on_cancel):
+        self.column = column
+        self.on_choose = on_choose
+        self.on_cancel = on_cancel
+        # Lower case text of the candidates as shown in the rows (i.e.,
+        # formatted), created at first search. They are searched in the
+        # same way as Pick.query() does.
+        self.texts = None
+        self.query = ''
+        self.edit = urwid.Edit('%s: ' % column.name)
+        self.walker = CandidateWalker(column)
+        if column.value_index < len(self.walker.indexes):
+            self.walker.focus = column.value_index
+        self.list = urwid.ListBox(self.walker)
+        pile = urwid.Pile([('pack', self.edit), self.list], focus_item=1)
+        box = urwid.AttrMap(urwid.LineBox(pile), 'misc')
+        super(Popup, self).__init__(box)
+
+    def keypress(self, size, key):
+        # Popup is modal. Keys aren't passed to other widgets.
+        if key == 'enter':
+            _, position = self.walker.get_focus()
+            if position is not None:
+                self.on_choose(self.walker.indexes[position])
+        elif key == 'esc':
+            self.on_cancel()
+        elif key in self.NAVIGATION_KEYS:
+            super(Popup, self).keypress(size, key)
+        else:
+            (maxcol, _) = size
+            self.edit.keypress((maxcol,), key)
+            self.search(self.edit.edit_text)
+
+    def search(self, query):
+        if query == self.query:
+            return
+        if self.texts is None:
+            column = self.column
+            self.texts = [column.get_text(i).lower()
+                          for i in range(len(column.value_candidates))]
+        # Adding characters to a query only narrows the result. Search
+        # in the previous result in that case.
+        if query.startswith(self.query):
+            indexes = self.walker.indexes
+        else:
+            indexes = range(len(self.texts))
+        self.query = query
+        matcher = match.Matcher(query)
+        self.walker.set_indexes([i for i in indexes
+                                 if matcher.match(self.texts[i])])
+
 
 class EventLoop(urwid.MainLoop):
-    def __init__(self, widget):
-        super(EventLoop, self).__init__(widget,
-                                        palette=theme.get_palette(),
+    FILTER_KEY = '/'
+
+    def __init__(self, widget, preview=None):
+        self.list = widget
+        self.preview = preview
+        if preview and preview.position == 'right':
+            widget = urwid.Columns([('weight', 2, widget),
+                                    ('weight', 1, preview)])
+        elif preview:
+            widget = urwid.Pile([('weight', 2, widget),
+                                 ('weight', 1, preview)])
+        self.frame = urwid.Frame(widget)
+        self.query = urwid.Edit(self.FILTER_KEY)
+        urwid.connect_signal(self.query, 'change', self.query_changed)
+        super(EventLoop, self).__init__(self.frame,
+                                        palette=common.theme.get_palette(),
                                         unhandled_input=self.global_keypress)
 
     def run(self):
+        # Don't return the result of the previous run if user quits
+        # without selecting.
+        global result
+        result = None
+        if self.preview:
+            self.preview.attach(self)
         try:
             super(EventLoop, self).run()
         except KeyboardInterrupt:
             pass
+        finally:
+            if self.preview:
+                self.preview.detach()
         return result # This is a global variable in this module.
 
+    def entering_idle(self):
+        # Focus may have moved after handling input. Update the preview
+        # before the screen is redrawn.
+        if self.preview:
+            self.preview.show(self.list.get_focus_item())
+        super(EventLoop, self).entering_idle()
+
     def global_keypress(self, key):
-        if key in ('q', 'esc'):
+        item = self.list.get_focus_item()
+        column = item.get_column_by_shortcut(key) if item else None
+        if self.frame.focus_position == 'footer':
+            # Keys not handled by the query editor
+            if key == 'esc':
+                self.query.set_edit_text('')
+                self.close_query()
+            elif key == 'enter':
+                self.close_query()
+        elif column and column.has_popup():
+            self.open_popup(item, column)
+        elif key == self.FILTER_KEY:
+            self.frame.footer = urwid.AttrMap(self.query, 'misc')
+            self.frame.focus_position = 'footer'
+        elif key in ('q', 'esc'):
             raise urwid.ExitMainLoop()
 
+    def open_popup(self, item, column):
+        def choose(index):
+            # Only the item is redrawn
+            column.value_index = index
+            item._invalidate()
+            self.close_popup()
 
-def sanitize_input(user_input, spec):
-    # Check unknown keys
-    for name in user_input.keys():
-        if name not in spec.keys():
-            raise ValueError('Unknown key: %s in %s' %
-                             (name, user_input))
+        popup = Popup(column, choose, self.close_popup)
+        self.widget = urwid.Overlay(popup, self.frame, 'center',
+                                    ('relative', 60), 'middle',
+                                    ('relative', 60))
 
-    # Add missing items with their default values
-    d = user_input.copy()
-    for name, value in spec.items():
-        if name not in d:
-            d[name] = value
-    return d
+    def close_popup(self):
+        self.widget = self.frame
 
+    def close_query(self):
+        self.frame.focus_position = 'body'
+        if not self.query.edit_text:
+            self.frame.footer = None
 
-def set_theme(new_theme):
-    """Set a custom theme.
+    def query_changed(self, edit, text):
+        self.list.set_query(text)
 
-    Args:
-        theme (dict): A dict containing text style name/value pairs.
-            Text style value is a tuple containing fg/bg colors.
 
-    For more details see Theme section in 'pydoc3 pypick' command output.
+def get_width(u, u_b):
+    """Return display width of a unicode string.
+
+    Args:
+        u (str): A unicode string.
+        u_b (bytes): UTF-8 encoding of the string.
     """
-    global theme
-    theme = Theme(new_theme)
+    # Each printable ASCII character takes one column. Don't bother
+    # wcswidth(), which checks characters one by one.
+    if len(u_b) == len(u) and u.isprintable():
+        return len(u)
+    return wcswidth(u)
 
 
-theme = Theme()
 result = None
@@ -1,3 +1,9 @@
+import subprocess
+import sys
+import threading
+
+import pytest
+
 from pypick import Pick
 
 def test_basic():
@@ -18,3 +24,140 @@ def test_basic():
     g1.add_entries(data_list)
     result = p.run()
     print(result)
+
+
+def test_query():
+    data_list = [{"name": "server-5",
+                  "host": "10.64.4.5",
+                  "user": ["root", "rayx"],
+                  "project": "project X",
+                  "description": "ubuntu 16.04"},
+                 {"name": "server-66",
+                  "host": "10.64.4.66",
+                  "user": ["root"],
+                  "project": "project Y",
+                  "description": "centos 7.4"}]
+
+    fields = ["name", "host", "user", "description"]
+    field_attrs = {"description": {"return": False}}
+    p = Pick(fields, ["project"], field_attrs)
+    p.add_entries(data_list)
+    assert p.query("SERVER-66") == [{"project": "project Y",
+                                     "name": "server-66",
+                                     "host": "10.64.4.66",
+                                     "user": "root"}]
+    assert [r["name"] for r in p.query("server root")] == ["server-5",
+                                                           "server-66"]
+    assert [r["name"] for r in p.query("rayx ubuntu")] == ["server-5"]
+    assert p.query("server", limit=1)[0]["name"] == "server-5"
+    assert p.query("project") == []
+    assert p.query_many(["centos", "nothing"]) == [p.query("centos"), []]
+
+    # Entries added later are found too
+    p.add_entries([{"name": "server-7", "host": "10.64.4.7"}])
+    assert p.query("server-7")[0]["host"] == "10.64.4.7"
+
+
+def test_invalid_args():
+    with pytest.raises(ValueError):
+        Pick(["name"], refresh_rate=0)
+    with pytest.raises(ValueError):
+        Pick(["name"], refresh_rate=-1)
+    with pytest.raises(ValueError):
+        Pick(["name"], preview=str, preview_position="left")
+
+
+def make_hosts(n):
+    return [{"name": "server-%d" % i,
+             "host": "10.64.%d.%d" % (i >> 8, i & 255),
+             "user": ["root"],
+             "rack": i % 4} for i in range(n)]
+
+
+def test_query_many():
+    p = Pick(["name", "host", "user"], group_by="rack")
+    p.add_entries(make_hosts(1000))
+    p.add_entries([{"name": "server-x", "host": "10.64.1.1"}])
+    texts = ["10.64.1.", "root 10.64.1.", "10.64.1.1", "root", "",
+             "10.64.1.1 server-x", "nothing", "10.64.1."]
+    for limit in (None, 1, 3):
+        assert p.query_many(texts, limit=limit) == \
+            [p.query(text, limit=limit) for text in texts]
+
+
+def test_query_threads():
+    p = Pick(["name", "host"])
+    p.add_entries(make_hosts(5000))
+    expected = [r["name"] for r in p.query("10.64.1")]
+    p = Pick(["name", "host"])
+    p.add_entries(make_hosts(5000))
+    results = []
+
+    # The index is built by the first query, whichever thread runs it
+    def query():
+        results.append([r["name"] for r in p.query("10.64.1")])
+
+    threads = [threading.Thread(target=query) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [expected] * 8
+
+
+def test_query_without_urwid():
+    # Run in a new interpreter, as other tests load urwid
+    code = ("import sys; from pypick import Pick; "
+            "p = Pick(['name']); p.add_entries([{'name': 'a'}]); "
+            "assert p.query('a') == [{'name': 'a'}]; "
+            "assert 'urwid' not in sys.modules")
+    subprocess.check_call([sys.executable, "-c", code])
+
+
+def test_query_format():
+    field_attrs = {"size": {"format": lambda n: "%dK" % (n // 1024)},
+                   "port": {"format": "port-{}".format}}
+    p = Pick(["name", "size", "port"], field_attrs=field_attrs)
+    p.add_entries([{"name": "a", "size": 2048, "port": [22, 80]},
+                   {"name": "b", "size": 4096, "port": []}])
+    # Queries match the text shown in UI, not the raw values
+    assert [r["name"] for r in p.query("2k")] == ["a"]
+    assert p.query("2048") == []
+    assert [r["name"] for r in p.query("port-80")] == ["a"]
+    assert p.query("port-80")[0]["size"] == 2048
+
+    # Missing fields are shown and searched as '', without calling format
+    p.add_entries([{"name": "c"}])
+    assert [r["name"] for r in p.query("c")] == ["c"]
+    assert p.query("port-") == p.query("port-80")
+    item = p.groups[0]._create_item(2)
+    assert [c.get_text() for c in item.columns] == ["c", "", ""]
+    assert p.groups[0]._create_item(1).columns[2].get_text() == ""
+
+
+def test_group_by():
+    data_list = [{"name": "server-%d" % i, "project": "project %d" % (i % 3)}
+                 for i in range(9)]
+    data_list.append({"name": "server-x"})
+
+    p = Pick(["name"], ["project"], group_by="project",
+             group_sort=lambda v: -int(v.split()[1]))
+    p.add_entries(data_list)
+    # Groups are sorted by the key, and entries without the field are in
+    # the default group.
+    assert [r["name"] for r in p.query("server")] == [
+        "server-x", "server-2", "server-5", "server-8", "server-1",
+        "server-4", "server-7", "server-0", "server-3", "server-6"]
+
+    # Entries are added to existing groups
+    p.add_entries([{"name": "server-9", "project": "project 0"}])
+    assert p.query("server")[-1]["name"] == "server-9"
+
+    # A list value is grouped by its first value
+    p = Pick(["name", "user"], group_by="user")
+    p.add_entries([{"name": "a", "user": ["root", "rayx"]},
+                   {"name": "b", "user": ["rayx"]},
+                   {"name": "c", "user": ["root"]},
+                   {"name": "d", "user": []}])
+    assert [r["name"] for r in p.query("")] == ["d", "a", "c", "b"]
+    assert [g.name for g in p._get_groups()] == ["_global", "root", "rayx"]
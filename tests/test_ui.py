@@ -1,4 +1,15 @@
-from pypick.ui import Column, Item, Group, List, EventLoop
+import json
+import os
+import select
+import threading
+import time
+
+import urwid
+
+from pypick import ui
+from pypick.match import Matcher
+from pypick.ui import Column, Item, Group, List, EventLoop, Feed, Popup, \
+    Preview, Selection
 
 def test_basic():
     name_column_attrs = {"width":20,
@@ -40,3 +51,305 @@ def test_basic():
     list = List([group1, group2])
     result = EventLoop(list).run()
     print(result)
+
+
+def test_feed():
+    received = []
+    feed = Feed(received.extend)
+    # Batches put before the feed is attached are kept in the queue
+    feed.put(1)
+    feed.put(2)
+    assert received == []
+    assert feed.drain() == [1, 2]
+
+    # Batches put after the feed is detached are handled directly
+    feed.closed = True
+    feed.put(3)
+    assert received == [3]
+
+
+class StubLoop:
+    """A minimal main loop supporting watch_pipe() and alarms."""
+    def __init__(self):
+        self.pipes = {}
+        self.alarms = []
+
+    def watch_pipe(self, callback):
+        rd, wr = os.pipe()
+        self.pipes[wr] = (rd, callback)
+        return wr
+
+    def remove_watch_pipe(self, wr):
+        rd, _ = self.pipes.pop(wr)
+        os.close(rd)
+
+    def set_alarm_in(self, sec, callback):
+        alarm = [time.monotonic() + sec, callback]
+        self.alarms.append(alarm)
+        return alarm
+
+    def remove_alarm(self, alarm):
+        self.alarms.remove(alarm)
+
+    def iterate(self, timeout=0.01):
+        rds = [rd for rd, _ in self.pipes.values()]
+        ready, _, _ = select.select(rds, [], [], timeout)
+        for rd, callback in list(self.pipes.values()):
+            if rd in ready:
+                callback(os.read(rd, 4096))
+        now = time.monotonic()
+        for alarm in [a for a in self.alarms if a[0] <= now]:
+            self.alarms.remove(alarm)
+            alarm[1](self, None)
+
+
+def test_feed_threads():
+    rate = 20
+    calls = []
+    received = []
+
+    def handler(batches):
+        calls.append(time.monotonic())
+        received.extend(batches)
+
+    loop = StubLoop()
+    feed = Feed(handler, rate=rate)
+    feed.put((-1, 0))
+    feed.attach(loop)
+
+    def produce(n):
+        for i in range(200):
+            feed.put((n, i))
+            if i % 20 == 0:
+                time.sleep(0.005)
+
+    threads = [threading.Thread(target=produce, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + 10
+    while len(received) < 1601 and time.monotonic() < deadline:
+        loop.iterate()
+    for t in threads:
+        t.join()
+    feed.detach()
+
+    # Every batch arrives exactly once
+    assert sorted(received) == [(-1, 0)] + \
+        [(n, i) for n in range(8) for i in range(200)]
+    # The handler is called at most once per interval
+    assert len(calls) > 1
+    for prev, next in zip(calls, calls[1:]):
+        assert next - prev >= 1.0 / rate - 0.001
+
+    # Batches put after the feed is detached are handled directly
+    feed.put((9, 0))
+    assert received[-1] == (9, 0)
+
+
+def wait_until(loop, predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        loop.iterate()
+    return predicate()
+
+
+def make_preview_item(name):
+    return Item([("name", name, {})], {}, {}, data={"name": name})
+
+
+def test_preview_debounce():
+    calls = []
+
+    def callback(data):
+        calls.append(time.monotonic())
+        return "preview of %s" % data["name"]
+
+    loop = StubLoop()
+    preview = Preview(callback, delay=0.1)
+    preview.attach(loop)
+    start = time.monotonic()
+    preview.show(make_preview_item("a"))
+    assert preview.text.text == Preview.LOADING
+    assert wait_until(loop, lambda: preview.text.text == "preview of a")
+    # The request only starts after focus stays on the item for 'delay'
+    assert len(calls) == 1
+    assert calls[0] - start >= 0.1
+    preview.detach()
+
+
+def test_preview_cancel():
+    calls = []
+
+    def callback(data):
+        calls.append(data["name"])
+        return data["name"]
+
+    loop = StubLoop()
+    preview = Preview(callback, delay=0.05)
+    preview.attach(loop)
+    # Focus moves on before the request for "a" starts
+    preview.show(make_preview_item("a"))
+    preview.show(make_preview_item("b"))
+    assert wait_until(loop, lambda: preview.text.text == "b")
+    time.sleep(0.1)
+    loop.iterate()
+    assert calls == ["b"]
+    preview.detach()
+
+
+def test_preview_cache():
+    calls = []
+
+    def callback(data):
+        calls.append(data["name"])
+        return data["name"]
+
+    loop = StubLoop()
+    preview = Preview(callback, delay=0, cache_size=2)
+    preview.attach(loop)
+    items = [make_preview_item(name) for name in "abc"]
+    for item in items:
+        preview.show(item)
+        assert wait_until(loop, lambda: preview.text.text == item.data["name"])
+    # Only the most recently used results are kept
+    assert list(preview.cache) == items[1:]
+    preview.show(items[1])
+    assert preview.text.text == "b"
+    preview.show(items[0])
+    assert preview.text.text == Preview.LOADING
+    assert wait_until(loop, lambda: preview.text.text == "a")
+    assert calls == ["a", "b", "c", "a"]
+    assert list(preview.cache) == [items[1], items[0]]
+    preview.detach()
+
+
+def test_preview_error():
+    def callback(data):
+        raise RuntimeError("no such host")
+
+    loop = StubLoop()
+    preview = Preview(callback, delay=0)
+    preview.attach(loop)
+    preview.show(make_preview_item("a"))
+    assert wait_until(loop, lambda: preview.text.text != Preview.LOADING)
+    assert preview.text.text == "Failed to get preview: no such host"
+    preview.detach()
+
+
+def test_format():
+    calls = []
+
+    def format(value):
+        calls.append(value)
+        return '%dK' % (value / 1024)
+
+    attrs = {"format": format}
+    items = [Item([("size", [i * 1024, 0], attrs)], {}, {})
+             for i in range(100)]
+    list = List([Group(items)])
+    # Values are formatted only when they're shown, and only once
+    assert calls == []
+    list.render((20, 5))
+    list.render((20, 5))
+    assert calls == [0, 1024, 2048, 3072]
+    # Raw values are returned
+    assert items[1].columns[0].value == 1024
+
+    # Missing and empty values are shown as '' without calling format
+    for value in ("", []):
+        item = Item([("size", value, attrs)], {}, {})
+        assert item.columns[0].get_text() == ""
+    assert calls == [0, 1024, 2048, 3072]
+
+
+def test_highlight():
+    item = Item([("name", "server-15", {"width": 12})], {}, {})
+    item.matcher = Matcher("1 SER")
+    column = item.columns[0]
+    text, attrs = column.get_text_and_attrs(width=12)
+    assert text == b"  server-15 "
+    # Runs of the same style are merged
+    assert attrs == [("normal", 2), ("match", 3), ("normal", 4),
+                     ("match", 1), ("normal", 2)]
+    # Highlighted text is truncated as well
+    text, attrs = column.get_text_and_attrs(focus=True, width=8)
+    assert text == b"  serve "
+    assert attrs == [("focused", 2), ("focused_match", 3), ("focused", 3)]
+
+
+def test_multi_select():
+    items = [Item([("name", "item-%d" % i, {})], {"index": i}, {})
+             for i in range(100)]
+    list_widget = List([Group(items, name="group")], multi_select=True)
+    size = (20, 10)
+    list_widget.render(size, focus=True)
+
+    def selected():
+        return [r["index"] for r in Selection(list_widget.body.groups)]
+
+    list_widget.keypress(size, " ")
+    list_widget.keypress(size, "j")
+    list_widget.keypress(size, "j")
+    list_widget.keypress(size, "=")
+    assert selected() == [0, 1, 2]
+    list_widget.keypress(size, "*")
+    assert len(Selection(list_widget.body.groups)) == 97
+    list_widget.keypress(size, "-")
+    assert selected() == []
+    list_widget.keypress(size, "+")
+    assert selected() == list(range(100))
+
+    # The selection works as a read-only list
+    selection = Selection(list_widget.body.groups)
+    expected = [{"name": "item-%d" % i, "index": i} for i in range(100)]
+    assert selection == expected
+    assert expected == selection
+    assert selection != expected[:99]
+    assert selection != "not a list"
+    assert expected[5] in selection
+    assert selection.index(expected[5]) == 5
+    assert list(reversed(selection))[0] == expected[-1]
+    assert selection[-1] == expected[-1]
+    assert selection[1:3] == expected[1:3]
+    assert json.loads(json.dumps(list(selection))) == expected
+
+
+def test_run_result(monkeypatch):
+    # Quitting without selecting returns None, not the previous result
+    monkeypatch.setattr(urwid.MainLoop, "run", lambda self: None)
+    monkeypatch.setattr(ui, "result", {"name": "a"})
+    list_widget = List([Group([Item([("name", "a", {})], {}, {})])])
+    assert EventLoop(list_widget).run() is None
+
+
+def test_popup():
+    users = ["user%d" % i for i in range(1000)]
+    item = Item([("user", users, {})], {}, {})
+    column = item.columns[0]
+    assert column.has_popup()
+
+    chosen = []
+    popup = Popup(column, chosen.append, None)
+    size = (30, 10)
+    popup.render(size, focus=True)
+    for key in "user99":
+        popup.keypress(size, key)
+    assert [users[i] for i in popup.walker.indexes] == \
+        ["user99"] + ["user99%d" % i for i in range(10)]
+    popup.keypress(size, "down")
+    popup.keypress(size, "enter")
+    assert chosen == [990]
+    # Only candidates shown are created
+    assert len(popup.walker.rows) < 20
+
+    # The text shown in rows (i.e., formatted) is searched
+    item = Item([("port", list(range(100)), {"format": "port-%d".__mod__})],
+                {}, {})
+    popup = Popup(item.columns[0], chosen.append, None)
+    popup.render(size, focus=True)
+    for key in "port":
+        popup.keypress(size, key)
+    assert len(popup.walker.indexes) == 100
+    for key in "-42":
+        popup.keypress(size, key)
+    assert popup.walker.indexes == [42]